@@ -5,6 +5,7 @@ import json
 import shutil
 import os
 import subprocess
+from pathlib import Path
 
 
 def parse(p):
@@ -13,6 +14,12 @@ def parse(p):
             yield json.loads(l.strip())
 
 
+def object_path(name):
+    # sharded store, falling back to flat objects from before sharding
+    sharded = Path("objects") / name[:2] / name[2:]
+    return sharded if sharded.exists() else Path("objects") / name
+
+
 @click.command()
 @click.argument("a", type=click.Path(exists=True))
 @click.argument("b", type=click.Path(exists=True))
@@ -51,9 +58,9 @@ def artifacts(a, b, sample):
         _b = sB['results'].get(k, ' ' * 20)
         print(_a, " = " if _a == _b else " ! ", _b, k)
         if _a != ' '*20:
-            shutil.copy("objects/" + _a, "/tmp/artA/" + k)
+            shutil.copy(object_path(_a), "/tmp/artA/" + k)
         if _b != ' '*20:
-            shutil.copy("objects/" + _b, "/tmp/artB/" + k)
+            shutil.copy(object_path(_b), "/tmp/artB/" + k)
         if k.endswith(".pdf"):
             subprocess.run(["pdfutil", "decompress", "-i",
                             "/tmp/artA/" + k, "-o", "/tmp/artA/_" + k])
@@ -0,0 +1,66 @@
+import os
+import tarfile
+import gzip
+import shutil
+import tempfile
+from pathlib import Path
+
+
+def is_tar(gz):
+    # POSIX/GNU tar header magic; a plain read instead of a libmagic probe.
+    # peek doesn't consume, so the gzip stream needn't be rewound and
+    # inflated again unless the first block came back short
+    header = gz.peek(512)
+    if len(header) < 512:
+        header = gz.read(512)
+        gz.seek(0)
+    return header[257:262] == b"ustar"
+
+
+def is_within_directory(directory, target):
+    abs_directory = os.path.abspath(directory)
+    abs_target = os.path.abspath(target)
+    # compare whole path components: a string prefix lets /tmp/dir through
+    # for /tmp/dirX
+    return (abs_target == abs_directory
+            or abs_target.startswith(abs_directory + os.sep))
+
+
+def safe_extract(tar, path):
+    # members are checked as the stream reaches them: a streamed tar can't be
+    # scanned with getmembers() first and then extracted
+    def checked_members():
+        for member in tar:
+            member_path = os.path.join(path, member.name)
+            if not is_within_directory(path, member_path):
+                raise Exception("Attempted Path Traversal in Tar File")
+            yield member
+
+    tar.extractall(path, checked_members())
+
+
+class TestEnv(object):
+    def __init__(self, sample, tar=None):
+        # tar: whether the sample is a tarball; read from its header if None
+        self.tmpdir = Path(tempfile.mkdtemp('ttrac'))
+        try:
+            with gzip.open(sample) as gz:
+                if tar is None:
+                    tar = is_tar(gz)
+                if tar:
+                    # untar straight off the gunzip stream, no intermediate .tar
+                    with tarfile.open(fileobj=gz, mode='r|') as tf:
+                        safe_extract(tf, self.tmpdir)
+                else:
+                    with open(self.tmpdir / sample.stem, "wb") as f:
+                        shutil.copyfileobj(gz, f)
+        except BaseException:
+            # __exit__ won't run for a half-extracted sample
+            shutil.rmtree(self.tmpdir)
+            raise
+
+    def __enter__(self):
+        return self.tmpdir
+
+    def __exit__(self, exc, value, tb):
+        shutil.rmtree(self.tmpdir)
@@ -11,6 +11,14 @@ def stream(p):
             yield json.loads(l)
 
 
+def object_files():
+    # objects/<first two digits>/<rest>, or flat objects/<name> from before
+    # the store was sharded; either way the name reports use is the digest
+    for x in Path("objects").rglob("*"):
+        if x.is_file():
+            yield "".join(x.relative_to("objects").parts), x
+
+
 @click.command()
 @click.argument("reports", nargs=-1)
 def gc(reports):
@@ -30,10 +38,11 @@ def gc(reports):
             if "results" in pkt:
                 live.update(pkt["results"].values())
                 updateUniques(r, pkt["results"].values())
-    files = set([x.name for x in Path("objects").iterdir() if x.is_file()])
+    paths = dict(object_files())
+    files = set(paths)
     files -= set([".gitignore"])
     def objectSize(objs): return str(
-        int(sum([(Path('objects') / x).stat().st_size for x in objs]) / 2**20)) + " MB"
+        int(sum([paths[x].stat().st_size for x in objs]) / 2**20)) + " MB"
     print(f"objects: {len(files)} - {objectSize(files)}")
     uniques = {k: v - notUniques[k] for k, v in uniques.items()}
     print("unique artifact sizes")
@@ -54,7 +63,7 @@ def gc(reports):
     if dead and click.confirm('Confirm GC?'):
         for x in dead:
             click.echo('rip ' + x)
-            (Path("objects") / x).unlink()
+            paths[x].unlink()
     else:
         for x in dead:
             click.echo("dead: " + x)
@@ -1,6 +1,8 @@
 import { Context } from "probot";
 
 export const PR_RUN_DATASET = "1702"
+// must match REPORT_VERSION in report_ci.py
+export const REPORT_VERSION = 1
 
 export interface Job {
     context?: Context<"pull_request">,
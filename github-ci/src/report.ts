@@ -1,4 +1,5 @@
-import { readFileSync, statSync } from "fs";
+import { existsSync, readFileSync, statSync } from "fs";
+import { REPORT_VERSION } from "./misc";
 
 export interface SampleRun {
     sample: string,
@@ -87,6 +88,15 @@ export function report_path(sha: string) {
     return '/root/reports/' + sha + '.jsonl'
 }
 
+// reports written by an older report_ci.py capture files differently and
+// would show spurious changes when compared against a current one
+export function report_is_current(sha: string) {
+    if (!existsSync(report_path(sha)))
+        return false
+    let meta = JSON.parse(readFileSync(report_path(sha)).toString().split('\n', 1)[0])
+    return meta.version === REPORT_VERSION
+}
+
 export function markdown_report(dataset: string, a: string, b: string, eta?: string) {
     const pre = (text: string) => '`' + text + '`';
 
@@ -1,8 +1,8 @@
 import { spawnSync, spawn } from "child_process"
-import { existsSync, readFileSync } from "fs"
+import { readFileSync } from "fs"
 import { Repository, Commit, Reset, Merge } from "nodegit"
 import { Job, PR_RUN_DATASET } from "./misc"
-import { report_path, markdown_report, get_changes } from "./report"
+import { report_path, report_is_current, markdown_report, get_changes } from "./report"
 
 
 const sleep = (m: number) => new Promise(r => setTimeout(r, m))
@@ -25,7 +25,7 @@ export async function get_merge_base(head_sha: string, base_sha: string) {
 }
 
 export async function run_check({ context, head_sha, head_branch, base_sha, check_run_id }: Job) {
-    if (existsSync(report_path(head_sha))) {
+    if (report_is_current(head_sha)) {
         console.log("skipping", head_sha)
         if (context && check_run_id)
             await context.octokit.checks.update(context.repo({
@@ -48,6 +48,8 @@ ENTRY_FILES = [
     'WaveParticleExperiment.tex',
 ]
 
+HEAD_SIZE = 64*1024
+
 
 def get_maindoc(p, sample):
     viable = []
@@ -59,7 +61,13 @@ def get_maindoc(p, sample):
         if x.name in ENTRY_FILES:
             return x
         with open(x, "rb") as f:
-            data = f.read()
+            # \documentclass sits near the top of a main file; only read the
+            # rest when it isn't there (\bye comes at the very end)
+            data = f.read(HEAD_SIZE)
+            if b"\\documentclass" in data:
+                viable.append(x)
+                continue
+            data += f.read()
             if b"\\documentclass" in data or b"\\bye" in data:
                 viable.append(x)
     if not viable and len(list(p.iterdir())) == 1:
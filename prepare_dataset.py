@@ -1,63 +1,13 @@
 import click
-import magic
 
-import threading
-import tempfile
 import os
 import json
-import tarfile
-import gzip
-import shutil
+import traceback
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
 
 from heuristics import get_maindoc, EXCLUDED_SAMPLES
-
-_libmagic_threadsafe = threading.Lock()
-
-
-class TestEnv(object):
-    def __init__(self, sample):
-        self.tmpdir = Path(tempfile.mkdtemp('ttrac'))
-        with _libmagic_threadsafe:
-            assert magic.detect_from_filename(
-                sample).mime_type == 'application/gzip'
-
-        submission_data_path = self.tmpdir / sample.stem
-
-        with gzip.open(sample) as gz:
-            with open(submission_data_path, "wb") as f:
-                shutil.copyfileobj(gz, f)
-
-        with _libmagic_threadsafe:
-            if magic.detect_from_filename(submission_data_path).mime_type == "application/x-tar":
-                with tarfile.open(submission_data_path, 'r') as tar:
-                    def is_within_directory(directory, target):
-                        
-                        abs_directory = os.path.abspath(directory)
-                        abs_target = os.path.abspath(target)
-                    
-                        prefix = os.path.commonprefix([abs_directory, abs_target])
-                        
-                        return prefix == abs_directory
-                    
-                    def safe_extract(tar, path=".", members=None, *, numeric_owner=False):
-                    
-                        for member in tar.getmembers():
-                            member_path = os.path.join(path, member.name)
-                            if not is_within_directory(path, member_path):
-                                raise Exception("Attempted Path Traversal in Tar File")
-                    
-                        tar.extractall(path, members, numeric_owner=numeric_owner) 
-                        
-                    
-                    safe_extract(tar, path=self.tmpdir)
-                submission_data_path.unlink()
-
-    def __enter__(self):
-        return self.tmpdir
-
-    def __exit__(self, exc, value, tb):
-        shutil.rmtree(self.tmpdir)
+from extract import TestEnv
 
 
 def prepare(sample):
@@ -67,10 +17,16 @@ def prepare(sample):
     if sample.stem in EXCLUDED_SAMPLES:
         return
 
-    with TestEnv(sample) as d:
-        maindoc = get_maindoc(d, sample)
-        if maindoc:
-            return maindoc.name
+    try:
+        with TestEnv(sample) as d:
+            maindoc = get_maindoc(d, sample)
+    except Exception:
+        # e.g. a corrupt .gz: leave the sample out of the dataset instead of
+        # failing the map and throwing away every other sample's result
+        traceback.print_exc()
+        return
+    if maindoc:
+        return maindoc.name
 
 
 @click.command()
@@ -80,11 +36,14 @@ def prepare_dataset(corpus):
     output_path = corpus + ".json"
     assert corpus[-1] != "/"
 
-    for sample in Path(corpus).iterdir():
-        res = prepare(sample)
-        if res:
-            print(sample.stem, res)
-            output[sample.stem] = res
+    # samples are independent; one process each so gunzip and untar run
+    # on all cores
+    samples = list(Path(corpus).iterdir())
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as ex:
+        for sample, res in zip(samples, ex.map(prepare, samples, chunksize=8)):
+            if res:
+                print(sample.stem, res)
+                output[sample.stem] = res
 
     with open(output_path, "w") as f:
         json.dump(output, f)
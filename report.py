@@ -1,32 +1,19 @@
 import click
-import magic
 
 import os
 import json
 from datetime import datetime
 import time
-import tarfile
-import gzip
 import shutil
 from pathlib import Path
 import subprocess
 import tempfile
-import hashlib
-from functools import reduce
 import queue
 import threading
 
-# https://stackoverflow.com/a/44873382
-
-
-def sha256sum(filename):
-    h = hashlib.sha256()
-    b = bytearray(128*1024)
-    mv = memoryview(b)
-    with open(filename, 'rb', buffering=0) as f:
-        for n in iter(lambda: f.readinto(mv), 0):
-            h.update(mv[:n])
-    return h.hexdigest()
+from heuristics import get_maindoc
+from extract import TestEnv
+from store import sha256sum_all, store_object, report_line
 
 
 TAGS = {
@@ -46,20 +33,33 @@ IMPLIED_TAGS = {k: set([k_ for k_, v_ in TAGS.items(
 ) if v_ in v and k_ != k]) for k, v in TAGS.items()}
 
 
+TAG_BITS = {k: 1 << i for i, k in enumerate(TAGS)}
+IMPLIED_MASK = {k: sum(TAG_BITS[x] for x in IMPLIED_TAGS[k]) for k in TAGS}
+
+# longest patterns first: once a tag is found, the tags it implies are
+# substrings of the same log and need no scan of their own
+_TAG_PATTERNS = [(TAG_BITS[k], IMPLIED_MASK[k], TAGS[k].encode())
+                 for k in sorted(TAGS, key=lambda k: len(TAGS[k]), reverse=True)]
+
+
 def get_tags(p):
     if p.exists():
-        with open(p) as f:
+        # bytes: skips decoding the whole log and can't fail on bad utf-8
+        with open(p, "rb") as f:
             data = f.read()
     else:
         return ["no-log-file"]
-    res = []
-    for k, v in TAGS.items():
+    found = 0
+    redundant = 0
+    for bit, implied, v in _TAG_PATTERNS:
+        # implied tags are skipped, never set: found & redundant stays 0
+        if redundant & bit:
+            continue
         if v in data:
-            res.append(k)
+            found |= bit
+            redundant |= implied
 
-    redundant = reduce(lambda a, b: a | b, [
-                       IMPLIED_TAGS[tag] for tag in res], set())
-    return sorted(list(set(res) - redundant))
+    return sorted(k for k, bit in TAG_BITS.items() if found & bit)
 
 
 _CAPTURE_EXCLUDE = set()  # TODO: why is this global
@@ -68,10 +68,9 @@ _CAPTURE_EXCLUDE = set()  # TODO: why is this global
 def capture_files(d, exclude_all=False):
     global _CAPTURE_EXCLUDE
     captured = {}
-    for f in d.iterdir():
-        if not f.is_file():
-            continue
-        digest = sha256sum(f)[:16]
+    files = [f for f in d.iterdir() if f.is_file()]
+    for f, digest in zip(files, sha256sum_all(files)):
+        digest = digest[:16]
         if exclude_all:
             _CAPTURE_EXCLUDE.add(digest)
             continue
@@ -79,61 +78,16 @@ def capture_files(d, exclude_all=False):
             continue
 
         ext = f.suffix or ".bin"
-        target = Path("objects") / (digest + ext)
+        # sharded on the first two hex digits like .git/objects, so no single
+        # directory grows huge; reports still name objects by digest + ext
+        target = Path("objects") / digest[:2] / (digest[2:] + ext)
         if not target.exists():
-            shutil.copy(f, target)
+            target.parent.mkdir(exist_ok=True)
+            store_object(f, target)
         captured[f.name] = digest + ext
     return captured
 
 
-_libmagic_threadsafe = threading.Lock()
-
-
-class TestEnv(object):
-    def __init__(self, sample):
-        self.tmpdir = Path(tempfile.mkdtemp('ttrac'))
-        with _libmagic_threadsafe:
-            assert magic.detect_from_filename(
-                sample).mime_type == 'application/gzip'
-
-        submission_data_path = self.tmpdir / sample.stem
-
-        with gzip.open(sample) as gz:
-            with open(submission_data_path, "wb") as f:
-                shutil.copyfileobj(gz, f)
-
-        with _libmagic_threadsafe:
-            if magic.detect_from_filename(submission_data_path).mime_type == "application/x-tar":
-                with tarfile.open(submission_data_path, 'r') as tar:
-                    def is_within_directory(directory, target):
-                        
-                        abs_directory = os.path.abspath(directory)
-                        abs_target = os.path.abspath(target)
-                    
-                        prefix = os.path.commonprefix([abs_directory, abs_target])
-                        
-                        return prefix == abs_directory
-                    
-                    def safe_extract(tar, path=".", members=None, *, numeric_owner=False):
-                    
-                        for member in tar.getmembers():
-                            member_path = os.path.join(path, member.name)
-                            if not is_within_directory(path, member_path):
-                                raise Exception("Attempted Path Traversal in Tar File")
-                    
-                        tar.extractall(path, members, numeric_owner=numeric_owner) 
-                        
-                    
-                    safe_extract(tar, path=self.tmpdir)
-                submission_data_path.unlink()
-
-    def __enter__(self):
-        return self.tmpdir
-
-    def __exit__(self, exc, value, tb):
-        shutil.rmtree(self.tmpdir)
-
-
 BUNDLE_URL = "https://data1.fullyjustified.net/tlextras-2021.3r1.tar"
 ARGUMENTS = [
     "-w", BUNDLE_URL,
@@ -219,16 +173,16 @@ def report(corpus, repo):
         if click.confirm("report file already exists. abort?"):
             return
         if click.confirm("continue report (vs overwrite)?"):
-            with open(reportpath) as f:
+            with open(reportpath, "rb") as f:
                 continueData = f.read()
             for l in continueData.splitlines()[1:]:
                 skipSamples.add(json.loads(l)["sample"])
-    reportlog = open(reportpath, "w")
+    reportlog = open(reportpath, "wb")
 
     if continueData:
         reportlog.write(continueData)
     else:
-        reportlog.write(json.dumps(meta) + "\n")
+        reportlog.write(report_line(meta))
     reportlog.flush()
     print(json.dumps(meta))
 
@@ -255,7 +209,7 @@ def report(corpus, repo):
             work.task_done()
             if report:
                 with outlock:
-                    reportlog.write(json.dumps(report) + "\n")
+                    reportlog.write(report_line(report))
                     reportlog.flush()
 
     threads = []
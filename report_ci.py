@@ -3,93 +3,51 @@ import os
 import json
 from datetime import datetime
 import time
-import tarfile
-import gzip
 import shutil
 from pathlib import Path
 import subprocess
 import tempfile
-import hashlib
-from functools import reduce
-import queue
+from functools import partial
 import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
+from extract import TestEnv
+from store import sha256sum_all, store_object, report_line
 
-def sha256sum(filename):
-    # https://stackoverflow.com/a/44873382
-    h = hashlib.sha256()
-    b = bytearray(128*1024)
-    mv = memoryview(b)
-    with open(filename, 'rb', buffering=0) as f:
-        for n in iter(lambda: f.readinto(mv), 0):
-            h.update(mv[:n])
-    return h.hexdigest()
 
+def file_identity(f):
+    st = f.stat()
+    return (st.st_size, st.st_mtime_ns, st.st_ino)
 
-def capture_files(d, excluded=None, as_set=False):
-    captured = {}
-    _set = set()
-    for f in d.iterdir():
-        if not f.is_file():
-            continue
-        digest = sha256sum(f)[:16]
-        if as_set:
-            _set.add(digest)
-            continue
-        elif excluded is not None and digest in excluded:
-            continue
 
+def capture_files(d, excluded=None, snapshot=False):
+    files = [f for f in d.iterdir() if f.is_file()]
+    if snapshot:
+        return {f.name: file_identity(f) for f in files}
+    if excluded is not None:
+        # files with an unchanged identity were left alone by the run:
+        # don't hash or copy them
+        files = [f for f in files if excluded.get(f.name) != file_identity(f)]
+
+    captured = {}
+    for f, digest in zip(files, sha256sum_all(files)):
+        digest = digest[:16]
         ext = f.suffix or ".bin"
-        target = Path("objects") / (digest + ext)
+        # sharded on the first two hex digits like .git/objects, so no single
+        # directory grows huge; reports still name objects by digest + ext
+        target = Path("objects") / digest[:2] / (digest[2:] + ext)
         if not target.exists():
-            shutil.copy(f, target)
+            target.parent.mkdir(exist_ok=True)
+            store_object(f, target)
         captured[f.name] = digest + ext
-    if as_set:
-        return _set
     return captured
 
 
-_libmagic_threadsafe = threading.Lock()
-
-
-class TestEnv(object):
-    def __init__(self, sample, is_tar):
-        self.tmpdir = Path(tempfile.mkdtemp('ttrac'))
-        submission_data_path = self.tmpdir / sample.stem
-        with gzip.open(sample) as gz:
-            with open(submission_data_path, "wb") as f:
-                shutil.copyfileobj(gz, f)
-
-        if is_tar:
-            with tarfile.open(submission_data_path, 'r') as tar:
-                def is_within_directory(directory, target):
-                    
-                    abs_directory = os.path.abspath(directory)
-                    abs_target = os.path.abspath(target)
-                
-                    prefix = os.path.commonprefix([abs_directory, abs_target])
-                    
-                    return prefix == abs_directory
-                
-                def safe_extract(tar, path=".", members=None, *, numeric_owner=False):
-                
-                    for member in tar.getmembers():
-                        member_path = os.path.join(path, member.name)
-                        if not is_within_directory(path, member_path):
-                            raise Exception("Attempted Path Traversal in Tar File")
-                
-                    tar.extractall(path, members, numeric_owner=numeric_owner) 
-                    
-                
-                safe_extract(tar, path=self.tmpdir)
-            submission_data_path.unlink()
-
-    def __enter__(self):
-        return self.tmpdir
-
-    def __exit__(self, exc, value, tb):
-        shutil.rmtree(self.tmpdir)
-
+# 1: inputs are excluded by name and stat identity rather than by content,
+# so an output with the same bytes as an input is now captured. reports
+# from different versions don't compare cleanly; github-ci reruns older ones
+REPORT_VERSION = 1
 
 BUNDLE_URL = "https://data1.fullyjustified.net/tlextras-2021.3r1.tar"
 ARGUMENTS = [
@@ -102,9 +60,13 @@ def do_work(sample, maindoc, tectonic):
     print(sample)
     env = os.environ.copy()
     env["SOURCE_DATE_EPOCH"] = "1456304492"
-    with TestEnv(sample, is_tar=(maindoc != sample.stem)) as d:
+    # the tmpdir outlives this call: the outputs are archived (and the tmpdir
+    # removed) by archive() in the parent, so this worker can go straight on
+    # to its next sample
+    d = TestEnv(sample, tar=(maindoc != sample.stem)).tmpdir
+    try:
         print(d)
-        excluded = capture_files(d, as_set=True)
+        excluded = capture_files(d, snapshot=True)
         start = time.time()
         try:
             test = subprocess.run([tectonic] + ARGUMENTS +
@@ -114,9 +76,18 @@ def do_work(sample, maindoc, tectonic):
         except subprocess.TimeoutExpired:
             statuscode = -99999
         delta = time.time() - start
-        results = capture_files(d, excluded=excluded)
-        report = dict(sample=sample.stem, statuscode=statuscode,
-                      seconds=delta, results=results)
+    except BaseException:
+        shutil.rmtree(d)
+        raise
+    report = dict(sample=sample.stem, statuscode=statuscode, seconds=delta)
+    return report, d, excluded
+
+
+def archive(report, d, excluded):
+    try:
+        report["results"] = capture_files(d, excluded=excluded)
+    finally:
+        shutil.rmtree(d)
     print(json.dumps(report))
     return report
 
@@ -137,7 +108,7 @@ def report(corpus, repo, name):
         "branch": branch,
         "commit": commit,
         "link": None,
-        "version": 0,
+        "version": REPORT_VERSION,
         "timestamp": timestamp,
         "dataset": Path(corpus).stem,
         "bundle_url": BUNDLE_URL,
@@ -146,9 +117,9 @@ def report(corpus, repo, name):
 
     reportpath = Path("reports") / (name + ".jsonl")
 
-    reportlog = open(reportpath, "w")
+    reportlog = open(reportpath, "wb")
 
-    reportlog.write(json.dumps(meta) + "\n")
+    reportlog.write(report_line(meta))
     reportlog.flush()
     print(json.dumps(meta))
 
@@ -161,43 +132,59 @@ def report(corpus, repo, name):
     tectonic_temp.close()
     tectonic = tectonic_temp.name
 
-    work = queue.Queue()
     outlock = threading.Lock()
-    num_worker_threads = 5
-
-    def worker():
-        while True:
-            item = work.get()
-            if item is None:
-                print("worker shutting down")
-                break
-            maindoc = sample_maindoc[item.stem]
-            report = do_work(item, maindoc, tectonic)
-            work.task_done()
-            assert report
-            with outlock:
-                reportlog.write(json.dumps(report) + "\n")
-                reportlog.flush()
-
-    threads = []
-    for _ in range(num_worker_threads):
-        t = threading.Thread(target=worker)
-        t.start()
-        threads.append(t)
-
-    for sample in Path(corpus).iterdir():
-        if sample.stem not in sample_maindoc:
-            continue
-        work.put(sample)
-
-    work.join()
-
-    for i in range(num_worker_threads):
-        work.put(None)
-    for t in threads:
-        t.join()
+
+    def write_report(report):
+        with outlock:
+            reportlog.write(report_line(report))
+            reportlog.flush()
+
+    def write_failed(sample):
+        # one broken sample (e.g. a corrupt .gz) mustn't cost the rest of the
+        # run; record it like the timeout's -99999
+        traceback.print_exc()
+        write_report(dict(sample=sample.stem, statuscode=-99998,
+                          seconds=0, results={}))
+
+    # processes rather than threads: extraction around each tectonic run is
+    # GIL-bound. archiving runs on threads here, overlapping the workers'
+    # next runs; hashlib releases the GIL while hashing
+    num_workers = 5
+    # each sample holds a tmpdir from extraction until it is archived; cap how
+    # many exist at once so the runs can't outpace the archiver
+    slots = threading.BoundedSemaphore(2 * num_workers)
+
+    def archive_and_write(sample, run):
+        try:
+            write_report(archive(*run))
+        except Exception:
+            write_failed(sample)
+        finally:
+            slots.release()
+
+    def run_done(sample, fut):
+        # called as each run finishes; a failed do_work has already removed
+        # its tmpdir
+        try:
+            run = fut.result()
+        except Exception:
+            write_failed(sample)
+            slots.release()
+            return
+        archiver.submit(archive_and_write, sample, run)
+
+    # the archiver is entered first so it outlives the runs that feed it
+    with ThreadPoolExecutor(max_workers=2) as archiver, \
+            ProcessPoolExecutor(max_workers=num_workers) as ex:
+        for sample in Path(corpus).iterdir():
+            if sample.stem not in sample_maindoc:
+                continue
+            slots.acquire()
+            fut = ex.submit(do_work, sample, sample_maindoc[sample.stem], tectonic)
+            fut.add_done_callback(partial(run_done, sample))
     reportlog.close()
 
 
-assert len(sys.argv) == 4, "report_ci.py corpus repo name"
-report(sys.argv[1], sys.argv[2], sys.argv[3])
+if __name__ == '__main__':
+    assert len(sys.argv) == 4, "report_ci.py corpus repo name"
+    report(sys.argv[1], sys.argv[2], sys.argv[3])
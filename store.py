@@ -0,0 +1,81 @@
+import os
+import json
+import orjson
+import shutil
+import tempfile
+import fcntl
+import hashlib
+import mmap
+from concurrent.futures import ThreadPoolExecutor
+
+
+# below this the read loop is as fast as mapping the file
+MMAP_MIN_SIZE = 4*1024*1024
+
+
+def sha256sum(filename):
+    # https://stackoverflow.com/a/44873382
+    # hashlib.sha256 is OpenSSL's, which already dispatches to the SHA-NI
+    # instructions when the CPU has them
+    with open(filename, 'rb', buffering=0) as f:
+        if os.fstat(f.fileno()).st_size >= MMAP_MIN_SIZE:
+            # one update over the whole mapping, no per-chunk read loop
+            with mmap.mmap(f.fileno(), 0, prot=mmap.PROT_READ) as mm:
+                return hashlib.sha256(mm).hexdigest()
+        h = hashlib.sha256()
+        b = bytearray(128*1024)
+        mv = memoryview(b)
+        for n in iter(lambda: f.readinto(mv), 0):
+            h.update(mv[:n])
+    return h.hexdigest()
+
+
+_hash_pool = ThreadPoolExecutor(max_workers=os.cpu_count())
+
+
+def sha256sum_all(filenames):
+    # hashlib releases the GIL while hashing, so a batch of files is hashed
+    # on several cores at once
+    if len(filenames) < 2:
+        return [sha256sum(f) for f in filenames]
+    return list(_hash_pool.map(sha256sum, filenames))
+
+
+# ioctl(2) FICLONE: copy-on-write clone on btrfs/xfs
+FICLONE = 0x40049409
+
+
+def store_object(src, target):
+    # objects are named by their content and never modified, so the store can
+    # share the source's data instead of copying it
+    try:
+        os.link(src, target)
+        return
+    except FileExistsError:
+        return
+    except OSError:
+        pass  # e.g. the tmpdir is on another filesystem
+    # clone or copy under a temp name and rename it into place: a target that
+    # exists is taken as the finished object, so it must never be partial
+    fd, tmp = tempfile.mkstemp(dir=target.parent, prefix=".", suffix=".tmp")
+    try:
+        with open(src, "rb") as fsrc, os.fdopen(fd, "wb") as fdst:
+            try:
+                fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+            except OSError:
+                shutil.copyfileobj(fsrc, fdst)
+        shutil.copymode(src, tmp)
+        os.replace(tmp, target)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def report_line(report):
+    # tarfile and iterdir turn non-utf-8 file names (old latin-1 .tex
+    # sources, and tectonic's outputs named after them) into surrogate
+    # escapes; orjson refuses those, json writes them as \udcXX
+    try:
+        return orjson.dumps(report) + b"\n"
+    except TypeError:
+        return json.dumps(report).encode() + b"\n"